@@ -104,12 +104,7 @@ class GoBoardUtil(object):
         color : {'b','w'}
             the color to generate the move for.
         """
-        moves = board.get_empty_points()
-        legal_moves = []
-        for move in moves:
-            if board.is_legal(move, color):
-                legal_moves.append(move)
-        return legal_moves
+        return where1d(board.legal_moves_mask(color)).tolist()
 
     @staticmethod       
     def generate_random_move(board, color, use_eye_filter):
@@ -146,8 +141,7 @@ class GoBoardUtil(object):
         Rows 1..size of goboard are copied into rows 0..size - 1 of board2d
         """
         size = goboard.size
-        board2d = np.zeros((size, size), dtype = np.int32)
-        for row in range(size):
-            start = goboard.row_start(row + 1)
-            board2d[row, :] = goboard.board[start : start + size]
-        return board2d
+        NS = size + 1
+        # rows 1..size are NS apart, each starting with its BORDER point
+        rows = goboard.board[NS : NS * (size + 1)].reshape(size, NS)
+        return np.array(rows[:, 1:], dtype = np.int32)
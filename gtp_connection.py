@@ -6,13 +6,40 @@ Parts of this code were originally based on the gtp module
 in the Deep-Go project by Isaac Henrion and Amos Storkey 
 at the University of Edinburgh.
 """
-import signal
 import time
 import traceback
+import numpy as np
 from sys import stdin, stdout, stderr
 from board_util import GoBoardUtil, BLACK, WHITE, EMPTY, BORDER, PASS, \
-    MAXSIZE, coord_to_point
-import re
+    MAXSIZE, coord_to_point, where1d
+
+"""
+Search result for a position that was cut off by the depth limit
+and is neither a proven win nor a proven loss.
+"""
+UNKNOWN = 2
+
+"""
+Depth of the last shallow iteration before solve searches to the end.
+Deeper depth-limited iterations cannot prove anything away from the
+end of the game, so their cost grows with the full branching factor.
+"""
+DEEPENING_DEPTH = 2
+
+"""
+Order moves by heuristic() ahead of the history heuristic.
+Off by default: it plays every candidate move and counts legal moves
+twice, which costs more per node than it saves in search.
+"""
+ENABLE_HEURISTIC = False
+
+"""
+Character for each point color in gogui-rules_board, indexed by color.
+"""
+BOARD_CHARS = np.empty(3, dtype='S1')
+BOARD_CHARS[EMPTY] = b'.'
+BOARD_CHARS[BLACK] = b'X'
+BOARD_CHARS[WHITE] = b'O'
 
 
 class GtpConnection():
@@ -33,7 +60,9 @@ class GtpConnection():
         self.board = board
         self.timelimit = 1
         self.tt= {self.board.size:TranspositionTable()}
-        self.history_heuristic= {self.board.size:HistoryHeuristicTable()}
+        self.history_heuristic= {self.board.size:HistoryHeuristicTable(self.board.maxpoint)}
+        self.killers = {self.board.size:new_killer_table(self.board.size)}
+        self._initialize_point_strings()
         self.commands = {
             "protocol_version": self.protocol_version_cmd,
             "quit": self.quit_cmd,
@@ -83,22 +112,21 @@ class GtpConnection():
         Start a GTP connection.
         This function continuously monitors standard input for commands.
         """
-        line = stdin.readline()
-        while line:
+        for line in stdin:
             self.get_cmd(line)
-            line = stdin.readline()
 
     def get_cmd(self, command):
         """
         Parse command string and execute it
         """
-        if len(command.strip(' \r\t')) == 0:
+        command = command.strip(' \r\t\n')
+        if not command:
             return
         if command[0] == '#':
             return
         # Strip leading numbers from regression tests
         if command[0].isdigit():
-            command = re.sub("^\d+", "", command).lstrip()
+            command = command.lstrip('0123456789').lstrip()
 
         elements = command.split()
         if not elements:
@@ -118,7 +146,6 @@ class GtpConnection():
         else:
             self.debug_msg("Unknown command: {}\n".format(command_name))
             self.error('Unknown command')
-            stdout.flush()
 
     def has_arg_error(self, cmd, argnum):
         """
@@ -150,12 +177,25 @@ class GtpConnection():
         """
         Reset the board to empty board of given size
         """
+        self.board.reset(size)
         if size not in self.tt:
             self.tt[size] = TranspositionTable()
-            self.history_heuristic[size] = HistoryHeuristicTable()
+            self.history_heuristic[size] = HistoryHeuristicTable(self.board.maxpoint)
+            self.killers[size] = new_killer_table(size)
+        self._initialize_point_strings()
         # self.tt = TranspositionTable()
         # self.history_heuristic = HistoryHeuristicTable()
-        self.board.reset(size)
+
+    def _initialize_point_strings(self):
+        """
+        Precompute format_point for every point of the current board size.
+        """
+        size = self.board.size
+        self._point_to_str = [None] * self.board.maxpoint
+        for row in range(1, size + 1):
+            for col in range(1, size + 1):
+                point = coord_to_point(row, col, size)
+                self._point_to_str[point] = format_point((row, col))
 
     def board2d(self):
         return str(GoBoardUtil.get_twoD_board(self.board))
@@ -219,12 +259,7 @@ class GtpConnection():
         board_color = args[0].lower()
         color = color_to_int(board_color)
         moves = GoBoardUtil.generate_legal_moves(self.board, color)
-        gtp_moves = []
-        for move in moves:
-            coords = point_to_coord(move, self.board.size)
-            gtp_moves.append(format_point(coords))
-        sorted_moves = ' '.join(sorted(gtp_moves))
-        self.respond(sorted_moves)
+        self.respond(' '.join(sorted(self._point_to_str[m] for m in moves)))
 
     def play_cmd(self, args):
         """
@@ -263,12 +298,13 @@ class GtpConnection():
         """
         board_color = args[0].lower()
         color = color_to_int(board_color)
-        move = negamax_boolean(self.board, self.tt[self.board.size], self.history_heuristic[self.board.size], 0)[1]
+        steps = self.board.count_steps()
+        empties = len(self.board.get_empty_points())
+        move = negamax_boolean(self.board, self.tt[self.board.size], self.history_heuristic[self.board.size], self.killers[self.board.size], steps, steps + empties, Deadline(float("inf")), [])[1]
         if move is None:
             self.respond("resign")
             return
-        move_coord = point_to_coord(move, self.board.size)
-        move_as_string = format_point(move_coord)
+        move_as_string = self._point_to_str[move]
         if self.board.is_legal(move, color):
             self.board.play_move(move, color)
             self.respond(move_as_string.lower())
@@ -281,65 +317,22 @@ class GtpConnection():
     def gogui_rules_board_size_cmd(self, args):
         self.respond(str(self.board.size))
 
-    def legal_moves_cmd(self, args):
-        """
-            List legal moves for color args[0] in {'b','w'}
-            """
-        board_color = args[0].lower()
-        color = color_to_int(board_color)
-        moves = GoBoardUtil.generate_legal_moves(self.board, color)
-        gtp_moves = []
-        for move in moves:
-            coords = point_to_coord(move, self.board.size)
-            gtp_moves.append(format_point(coords))
-        sorted_moves = ' '.join(sorted(gtp_moves))
-        self.respond(sorted_moves)
-
     def gogui_rules_legal_moves_cmd(self, args):
-        empties = self.board.get_empty_points()
         color = self.board.current_player
-        legal_moves = []
-        for move in empties:
-            if self.board.is_legal(move, color):
-                legal_moves.append(move)
-
-        gtp_moves = []
-        for move in legal_moves:
-            coords = point_to_coord(move, self.board.size)
-            gtp_moves.append(format_point(coords))
-        sorted_moves = ' '.join(sorted(gtp_moves))
-        self.respond(sorted_moves)
+        legal_moves = where1d(self.board.legal_moves_mask(color))
+        self.respond(' '.join(sorted(self._point_to_str[m] for m in legal_moves)))
 
     def gogui_rules_side_to_move_cmd(self, args):
         color = "black" if self.board.current_player == BLACK else "white"
         self.respond(color)
 
     def gogui_rules_board_cmd(self, args):
-        size = self.board.size
-        str = ''
-        for row in range(size - 1, -1, -1):
-            start = self.board.row_start(row + 1)
-            for i in range(size):
-                point = self.board.board[start + i]
-                if point == BLACK:
-                    str += 'X'
-                elif point == WHITE:
-                    str += 'O'
-                elif point == EMPTY:
-                    str += '.'
-                else:
-                    assert False
-            str += '\n'
-        self.respond(str)
+        rows = BOARD_CHARS[GoBoardUtil.get_twoD_board(self.board)][::-1]
+        self.respond(b''.join(row.tobytes() + b'\n' for row in rows).decode())
 
     def gogui_rules_final_result_cmd(self, args):
-        empties = self.board.get_empty_points()
         color = self.board.current_player
-        legal_moves = []
-        for move in empties:
-            if self.board.is_legal(move, color):
-                legal_moves.append(move)
-        if not legal_moves:
+        if not self.board.legal_moves_mask(color).any():
             result = "black" if self.board.current_player == WHITE else "white"
         else:
             result = "unknown"
@@ -361,58 +354,33 @@ class GtpConnection():
             self.timelimit = a
             self.respond()
 
-
-    def handler(self, signum, frame):
-        raise TimeoutError
-        # pass
-
     def solve(self, args):
         steps = self.board.count_steps();
-        # start = time.process_time()
-        # tt_copy = self.tt.table.copy()
-        # hh_copy = self.history_heuristic.table.copy()
-        board_copy = self.board.copy()
-        signal.signal(signal.SIGALRM, self.handler)
-        signal.alarm(self.timelimit)
+        empties = len(self.board.get_empty_points())
+        deadline = Deadline(self.timelimit)
+        move_log = []
         try:
-            move = negamax_boolean(self.board, self.tt[self.board.size], self.history_heuristic[self.board.size], steps)[1]
-            signal.alarm(0)
+            # iterative deepening: each iteration leaves best moves in the
+            # tt that order the next, deeper one
+            for d in list(range(1, DEEPENING_DEPTH + 1)) + [empties + 1]:
+                result, move = negamax_boolean(self.board, self.tt[self.board.size], self.history_heuristic[self.board.size], self.killers[self.board.size], steps, steps + d, deadline, move_log)
+                if result != UNKNOWN:
+                    break
         except TimeoutError:
-            signal.alarm(0)
+            # take back the moves of the interrupted search
+            while move_log:
+                self.board.undoMove(move_log.pop())
+            result = UNKNOWN
+        if result == UNKNOWN:
             self.respond("unknown")
-            # self.tt = TranspositionTable()
-            # self.tt.table = tt_copy
-            # self.history_heuristic = HistoryHeuristicTable()
-            # self.history_heuristic.table = hh_copy
-            self.board = board_copy
-            # print(self.tt)
-            # print(self.history_heuristic)
-            return
-        # time_used = time.process_time() - start
-        # print("time used: {}s".format(time_used))
-        # print(self.tt)
-        # print(self.history_heuristic)
-        if move is not None:
+        elif move is not None:
             color = "b" if self.board.current_player == BLACK else "w"
-            self.respond("{} {}".format(color, format_point(point_to_coord(move, self.board.size)).lower()))
+            self.respond("{} {}".format(color, self._point_to_str[move].lower()))
         else:
             color = "w" if self.board.current_player == BLACK else "b"
             self.respond(color)
 
 
-def point_to_coord(point, boardsize):
-    """
-    Transform point given as board array index 
-    to (row, col) coordinate representation.
-    Special case: PASS is not transformed
-    """
-    if point == PASS:
-        return PASS
-    else:
-        NS = boardsize + 1
-        return divmod(point, NS)
-
-
 def format_point(move):
     """
     Return move coordinates as a string such as 'a1', or 'pass'.
@@ -464,118 +432,155 @@ def color_to_int(c):
     return color_to_int[c]
 
 
-def store_result(tt, board, result, move):
-    # all_code = board.get_all_codes()
-    # map(lambda x: tt.store(x, result, move), all_code)
-    # for i in all_code:
-    #     tt.store(i, result, move)
-    # print(str(GoBoardUtil.get_twoD_board(board)))
-    # print(result,format_point(point_to_coord(move, board.size)))
-    tt.store(board.code(), result, move)
-    return result, move
-
-
 def heuristic(move, board):
-    # new_moves = GoBoardUtil.generate_legal_moves(board,board.current_player)
-    # print("compare board: {}".format(board.board))
-    # if move not in new_moves:
-    #     print(new_moves)
-    if not board.if_any_stone_nearby(move,board.current_player):
-        return 1
+    """
+    Legal moves that move takes away from both players together:
+    the opponent's loss plus the loss of the player to move.
+    Moves with no own stone nearby score 1.
+    """
     current_player = board.current_player
-    opponent = GoBoardUtil.opponent(current_player)
-    
-    # current moves for current player
-    # moves_current = GoBoardUtil.generate_legal_moves(board,current_player)
-    # current moves of opponent
-    # moves_opponent = GoBoardUtil.generate_legal_moves(board,opponent)
-    moves_current,moves_opponent = board.get_legal_move_count_for_two_color(current_player)
-
-    # current player plays
+    if not board.if_any_stone_nearby(move, current_player):
+        return 1
+    moves_current, moves_opponent = board.get_legal_move_count_for_two_color(current_player)
     board.play_move(move, current_player)
-    # print("plays")
-    after_move_current,after_move_opponent = board.get_legal_move_count_for_two_color(current_player)
+    after_move_current, after_move_opponent = board.get_legal_move_count_for_two_color(current_player)
     board.undoMove(move)
-    # legal moves removed for opponent
-    moves_reduced_opponent = moves_opponent-after_move_opponent
-    # legal moves removed for current player
-    moves_reduced_current = after_move_current-moves_current
-
-    benefit_for_current = moves_reduced_opponent - moves_reduced_current
-
-    return benefit_for_current
-
-def negamax_boolean(board, tt, history_table, depth):
-    result = tt.lookup(board.code())
-    if result is not None:
-        return result
-    # if board.size >= 4 and board.current_player == WHITE and depth == 1:
-        
-    #     if_symmetry = board.get_symmetry()
-    #     if if_symmetry is not None:
-    #         board.play_move(if_symmetry, board.current_player)
-    #         moves = GoBoardUtil.generate_legal_moves(board, board.current_player)
-    #         for move in moves:
-    #             board.play_move(move, board.current_player)
-    #             store_result(tt, board, False, None)
-    #             board.undoMove(move)
-    #         board.undoMove(if_symmetry)
-    #         return store_result(tt, board, True, if_symmetry)
-
-    # moves = board.get_empty_points()
-    # moves = board.generate_legal_moves()
-    moves = GoBoardUtil.generate_legal_moves(board, board.current_player)
-    # print("original: ",moves)
-    # moves.sort(key=lambda i: (history_table.lookup(i),-board.can_be_played(i)),reverse=True)
-    # moves.sort(key=lambda i: (history_table.lookup(i),board.edges_near_by(i)),reverse=True)
-    # moves.sort(key=lambda i: (heuristic(i,board),history_table.lookup(i)),reverse=True)
-    moves.sort(key=lambda x: history_table.lookup(x), reverse=True)
-    # if depth%10 == 0:
-    #     moves.sort(key=lambda x: heuristic(x,board), reverse=True)
-    # moves.sort(key=lambda i: board.edges_near_by(i), reverse=True)
-    # print("sorted: ", moves)
-    for move in moves:
+    moves_reduced_opponent = moves_opponent - after_move_opponent
+    moves_reduced_current = moves_current - after_move_current
+    return moves_reduced_opponent + moves_reduced_current
+
+def new_killer_table(size):
+    """
+    Two killer move slots for every depth (number of stones on the board),
+    slot 0 holding the most recent cutoff move. -1 marks an empty slot.
+    """
+    return np.full((size * size + 1, 2), -1, dtype=np.int32)
 
-        board.play_move(move, board.current_player)
 
-        # print("play {}".format(format_point(point_to_coord(move, 4))))
-        success = not negamax_boolean(board, tt, history_table, depth + 1)[0]
-        board.undoMove(move)
-        # print("unplay {}".format(format_point(point_to_coord(move, 4))))
-        if success:
+def negamax_boolean(board, tt, history_table, killers, depth, depth_limit, deadline, move_log):
+    if deadline.passed():
+        raise TimeoutError
+    # tt entries are shared by symmetric positions;
+    # their moves are stored relative to the canonical one
+    code, sym = board.canonical_code()
+    to_canonical = board.sym_to[sym]
+    from_canonical = board.sym_from[sym]
+    tt_move = None
+    entry = tt.lookup(code)
+    if entry is not None:
+        score = entry >> TranspositionTable.SCORE_SHIFT
+        tt_move = entry & TranspositionTable.NO_MOVE
+        tt_move = None if tt_move == TranspositionTable.NO_MOVE else int(from_canonical[tt_move])
+        if score != UNKNOWN:
+            return bool(score), tt_move
+    if depth >= depth_limit:
+        return UNKNOWN, None
+    color = board.current_player
+    legal = board.legal_moves_mask(color)
+    if not legal.any():
+        # no legal move: a loss
+        tt.store(code, False, None)
+        return False, None
+    moves = where1d(legal)
+    # stable, so ties keep board order as list.sort(reverse=True) did
+    moves = moves[np.argsort(-history_table.table[moves], kind='stable')].tolist()
+    if ENABLE_HEURISTIC:
+        moves.sort(key=lambda x: heuristic(x, board), reverse=True)
+    # try the best move of a previous, shallower search first,
+    # then the killer moves of this depth
+    killer0, killer1 = killers[depth].tolist()
+    hints = [killer1, killer0]
+    if tt_move is not None:
+        hints.append(tt_move)
+    for hint in hints:
+        if hint in moves:
+            moves.remove(hint)
+            moves.insert(0, hint)
+    best = None
+    for move in moves:
+        board.play_move(move, color)
+        move_log.append(move)
+        child = negamax_boolean(board, tt, history_table, killers, depth + 1, depth_limit, deadline, move_log)[0]
+        board.undoMove(move_log.pop())
+        if child == UNKNOWN:
+            if best is None:
+                best = move
+        elif not child:
             history_table.update(move, depth)
-            return store_result(tt, board, True, move)
-            # return True, move
+            if move != killer0:
+                killers[depth, 1] = killer0
+                killers[depth, 0] = move
+            tt.store(code, True, to_canonical[move])
+            return True, move
+
+    if best is not None:
+        tt.store(code, UNKNOWN, to_canonical[best])
+        return UNKNOWN, best
+    tt.store(code, False, None)
+    return False, None
+
+class Deadline:
+    """
+    Time limit for a search, measured with time.monotonic().
+    The clock is only read every check_interval calls to passed().
+    """
+    def __init__(self, seconds, check_interval=64):
+        self.end = time.monotonic() + seconds
+        self.check_interval = check_interval
+        self.count = 0
+
+    def passed(self):
+        self.count += 1
+        if self.count % self.check_interval == 0:
+            return time.monotonic() > self.end
+        return False
 
-    return store_result(tt, board, False, None)
-    # return False, None
 
 class TranspositionTable:
-    def __init__(self):
-        self.table = {}
+    """
+    Fixed-size, always-replace transposition table.
+    Entries live in two uint64 arrays indexed by code & (N-1).
+    An entry is a single int: the score (False, True or UNKNOWN)
+    shifted by SCORE_SHIFT, or-ed with the move (NO_MOVE for None).
+    """
+    SCORE_SHIFT = 31
+    NO_MOVE = (1 << SCORE_SHIFT) - 1
+
+    def __init__(self, size_pow2=1 << 22):
+        assert size_pow2 & (size_pow2 - 1) == 0
+        self.mask = size_pow2 - 1
+        self.keys = np.zeros(size_pow2, dtype=np.uint64)
+        self.vals = np.zeros(size_pow2, dtype=np.uint64)
 
     def __repr__(self):
-        return self.table.__repr__()
+        used = np.count_nonzero(self.vals)
+        return "TranspositionTable({}/{} used)".format(used, self.mask + 1)
 
     def store(self, code, score, move):
-        self.table[code] = (score, move)
+        i = code & self.mask
+        if move is None:
+            move = self.NO_MOVE
+        self.keys[i] = code
+        self.vals[i] = (int(score) << self.SCORE_SHIFT) | int(move)
 
     def lookup(self, code):
-        return self.table.get(code)
+        """
+        Return the packed entry for code, or None.
+        """
+        i = code & self.mask
+        val = int(self.vals[i])
+        # val is never 0 for a stored entry: move 0 is a BORDER point
+        if val == 0 or int(self.keys[i]) != code:
+            return None
+        return val
 
 
 class HistoryHeuristicTable:
-    def __init__(self):
-        self.table = {}
+    def __init__(self, n):
+        self.table = np.zeros(n, dtype=np.int64)
 
     def __repr__(self):
         return self.table.__repr__()
 
     def update(self, move, depth):
-        if move in self.table:
-            self.table[move] += depth**2
-        else:
-            self.table[move] = depth**2
-
-    def lookup(self, code):
-        return self.table.get(code) or 0
+        self.table[move] += depth * depth
@@ -10,12 +10,107 @@ The board uses a 1-dimensional representation with padding
 """
 
 import numpy as np
-import random
-from operator import xor
 from board_util import GoBoardUtil, BLACK, WHITE, EMPTY, BORDER, \
     PASS, is_black_white, coord_to_point, where1d, \
     MAXSIZE, NULLPOINT
 
+"""
+Symmetries of the square board, one pair of tables per board size.
+SYMMETRIES[size] = (to, back): to[s, point] is the image of point under
+symmetry s, and back[s] is the inverse permutation. Symmetry 0 is the
+identity. BORDER points map to themselves.
+"""
+SYMMETRIES = {}
+
+
+def symmetry_tables(size, maxpoint):
+    if size not in SYMMETRIES:
+        NS = size + 1
+        to = np.tile(np.arange(maxpoint, dtype=np.int16), (8, 1))
+        for row in range(1, size + 1):
+            for col in range(1, size + 1):
+                r, c = size + 1 - row, size + 1 - col
+                images = [(row, col), (col, row), (r, col), (row, c),
+                          (r, c), (col, r), (c, row), (c, r)]
+                for sym, (ir, ic) in enumerate(images):
+                    to[sym, row * NS + col] = ir * NS + ic
+        back = np.empty_like(to)
+        for sym in range(8):
+            back[sym, to[sym]] = np.arange(maxpoint, dtype=np.int16)
+        SYMMETRIES[size] = to, back
+    return SYMMETRIES[size]
+
+"""
+Source of legal_bits(own, opp): the bitboard of the legal moves for
+the player owning the stones in own. This is the only implementation
+of the NoGo rule; is_legal and play_move check single points with it.
+An empty point is legal unless it is the last liberty of an opponent
+block, or playing it leaves the new block without liberty: it needs an
+empty neighbor or a neighboring own block that has another liberty,
+i.e. one not in atari.
+It is compiled once per board size with NS and the on-board mask as
+literals, and the neighbor shifts written out inline.
+"""
+LEGAL_BITS_TEMPLATE = """
+def atari_blocks(stones, empty):
+    atari = 0
+    while stones:
+        block = stones & -stones
+        while True:
+            grown = (block | (block << 1) | (block >> 1)
+                     | (block << {NS}) | (block >> {NS})) & stones
+            if grown == block:
+                break
+            block = grown
+        libs = ((block << 1) | (block >> 1)
+                | (block << {NS}) | (block >> {NS})) & empty
+        if libs & (libs - 1) == 0:
+            atari |= block
+        stones &= ~block
+    return atari
+
+def legal_bits(own, opp):
+    empty = {ONBOARD} & ~(own | opp)
+    safe = own & ~atari_blocks(own, empty)
+    atari = atari_blocks(opp, empty)
+    near_empty = (empty << 1) | (empty >> 1) | (empty << {NS}) | (empty >> {NS})
+    near_safe = (safe << 1) | (safe >> 1) | (safe << {NS}) | (safe >> {NS})
+    near_atari = (atari << 1) | (atari >> 1) | (atari << {NS}) | (atari >> {NS})
+    return empty & (near_empty | near_safe) & ~near_atari
+"""
+LEGAL_BITS = {}
+
+
+def legal_bits_function(size, onboard):
+    if size not in LEGAL_BITS:
+        src = LEGAL_BITS_TEMPLATE.format(NS=size + 1, ONBOARD=hex(onboard))
+        namespace = {}
+        exec(compile(src, '<legal_bits_{}>'.format(size), 'exec'), namespace)
+        LEGAL_BITS[size] = namespace['legal_bits'], namespace['atari_blocks']
+    return LEGAL_BITS[size]
+
+"""
+Zobrist keys, one table per board size, shared by all boards of that size.
+ZOBRIST[size][color][point] holds 8 keys for a stone of color on point,
+one for the image of point under each symmetry, so that a board can keep
+the hash of all 8 symmetric positions up to date.
+The EMPTY row is all zero so that an empty point contributes nothing.
+ZOBRIST_TO_PLAY is part of the hash exactly when WHITE is to play.
+"""
+ZOBRIST = {}
+ZOBRIST_TO_PLAY = 0x5bd1e9955bd1e995
+
+
+def zobrist_table(size, maxpoint):
+    if size not in ZOBRIST:
+        rng = np.random.default_rng(size)
+        keys = rng.integers(1, 1 << 63, size=(3, maxpoint), dtype=np.uint64)
+        keys[EMPTY] = 0
+        to = symmetry_tables(size, maxpoint)[0]
+        # keys[:, to] has shape (3, 8, maxpoint)
+        ZOBRIST[size] = keys[:, to].transpose(0, 2, 1).tolist()
+    return ZOBRIST[size]
+
 
 class SimpleGoBoard(object):
 
@@ -29,24 +124,51 @@ class SimpleGoBoard(object):
         """
         Check whether it is legal for color to play on point
         """
-        board_copy = self.copy()
-        # Try to play the move on a temporary copy of board
-        # This prevents the board from being messed up by the move
-        try:
-            legal = board_copy.play_move(point, color)
-        except:
+        if point == PASS:
             return False
+        if self.board[point] != EMPTY:
+            return False
+        return self._illegal_reason(int(point), color) is None
 
-        return legal
+    def _stones(self, color):
+        """ Bitboard of the stones of color """
+        return self.bb_black if color == BLACK else self.bb_white
 
-    def _detect_captures(self, point, opp_color):
+    def _legal_bits(self, color):
         """
-        Did move on point capture something?
+        Bitboard of the legal moves for color.
+        See LEGAL_BITS_TEMPLATE for the rule.
         """
-        for nb in self.neighbors_of_color(point, opp_color):
-            if self._detect_capture(nb):
-                return True
-        return False
+        return self._legal_bits_kernel(self._stones(color),
+                                       self._stones(GoBoardUtil.opponent(color)))
+
+    def legal_moves_mask(self, color):
+        """
+        Return:
+            boolean numpy array of length maxpoint, True at the legal moves
+            for color
+        """
+        legal = self._legal_bits(color)
+        nbytes = (self.maxpoint + 7) // 8
+        bits = np.frombuffer(legal.to_bytes(nbytes, 'little'), dtype=np.uint8)
+        return np.unpackbits(bits, bitorder='little')[:self.maxpoint].astype(bool)
+
+    def _illegal_reason(self, point, color):
+        """
+        Check the NoGo rules for color playing on the empty point,
+        using the legal_bits kernel.
+        Returns None if the move is legal, otherwise "capture" or "suicide".
+        """
+        own = self._stones(color)
+        opp = self._stones(GoBoardUtil.opponent(color))
+        if (self._legal_bits_kernel(own, opp) >> point) & 1:
+            return None
+        # illegal: either point is the last liberty of an opponent block,
+        # or the new block would have none
+        empty = self.bb_onboard & ~(own | opp)
+        if self.neighbor_mask[point] & self._atari_blocks_kernel(opp, empty):
+            return "capture"
+        return "suicide"
 
     def get_empty_points(self):
         """
@@ -71,25 +193,57 @@ class SimpleGoBoard(object):
         self.size = size
         self.NS = size + 1
         self.WE = 1
-        self.ko_recapture = None
         self.current_player = BLACK
         self.maxpoint = size * size + 3 * (size + 1)
         self.board = np.full(self.maxpoint, BORDER, dtype=np.int32)
         self.liberty_of = np.full(self.maxpoint, NULLPOINT, dtype=np.int32)
         self._initialize_empty_points(self.board)
         self._initialize_neighbors()
-        random.seed(1)
-        self.zobTable = [[random.randint(1, 2 ** 32 - 1) for i in range(3)] for j in range(size * size)]
+        self.sym_to, self.sym_from = symmetry_tables(size, self.maxpoint)
+        self.zobTable = zobrist_table(size, self.maxpoint)
+        self._hashes = [0] * 8
+        self._initialize_bitboards()
+
+    def _initialize_bitboards(self):
+        """
+        Bitboards: bit p of an int is set for point p.
+        bb_black and bb_white are updated by play_move and undoMove.
+        neighbor_mask[p] holds the on-board neighbors of p,
+        nearby_mask[p] additionally holds the on-board diagonal neighbors.
+        """
+        self.bb_black = 0
+        self.bb_white = 0
+        self.bb_onboard = 0
+        for point in where1d(self.board == EMPTY):
+            self.bb_onboard |= 1 << int(point)
+        self.neighbor_mask = []
+        self.nearby_mask = []
+        for point in range(self.maxpoint):
+            if self.board[point] == BORDER:
+                self.neighbor_mask.append(0)
+                self.nearby_mask.append(0)
+                continue
+            mask = 0
+            for nb in self._neighbors(point):
+                mask |= 1 << nb
+            diag = 0
+            for d in self._diag_neighbors(point):
+                diag |= 1 << d
+            self.neighbor_mask.append(mask & self.bb_onboard)
+            self.nearby_mask.append((mask | diag) & self.bb_onboard)
+        self._legal_bits_kernel, self._atari_blocks_kernel = \
+            legal_bits_function(self.size, self.bb_onboard)
 
     def copy(self):
         b = SimpleGoBoard(self.size)
         assert b.NS == self.NS
         assert b.WE == self.WE
-        b.ko_recapture = self.ko_recapture
         b.current_player = self.current_player
         assert b.maxpoint == self.maxpoint
         b.board = np.copy(self.board)
-        b.zobTable = self.zobTable
+        b._hashes = list(self._hashes)
+        b.bb_black = self.bb_black
+        b.bb_white = self.bb_white
         return b
 
     def row_start(self, row):
@@ -210,37 +364,6 @@ class SimpleGoBoard(object):
                     pointstack.append(nb)
         return marker
 
-    def _fast_liberty_check(self, nb_point):
-        lib = self.liberty_of[nb_point]
-        if lib != NULLPOINT and self.get_color(lib) == EMPTY:
-            return True  # quick exit, block has a liberty
-        if self._stone_has_liberty(nb_point):
-            return True  # quick exit, no need to look at whole block
-        return False
-
-    def _detect_capture(self, nb_point):
-        """
-        Check whether opponent block on nb_point is captured.
-        Returns boolean.
-        """
-        if self._fast_liberty_check(nb_point):
-            return False
-        opp_block = self._block_of(nb_point)
-        return not self._has_liberty(opp_block)
-
-    def _detect_and_process_capture(self, nb_point):
-        """
-        Check whether opponent block on nb_point is captured.
-        If yes, remove the stones.
-        Returns the stone if only a single stone was captured,
-            and returns None otherwise.
-        This result is used in play_move to check for possible ko
-        """
-        opp_block = self._block_of(nb_point)
-        if not self._has_liberty(opp_block):
-            return True
-        return False
-
     def play_move(self, point, color):
         """
         Play a move of color on point
@@ -252,69 +375,53 @@ class SimpleGoBoard(object):
             return False
         elif self.board[point] != EMPTY:
             raise ValueError("occupied")
-        if point == self.ko_recapture:
-            return False
 
-        # General case: deal with captures, suicide, and next ko point
-        opp_color = GoBoardUtil.opponent(color)
-        in_enemy_eye = self._is_surrounded(point, opp_color)
+        # General case: captures and suicide are both illegal in NoGo,
+        # so there is never a ko point
+        point = int(point)
+        reason = self._illegal_reason(point, color)
+        if reason is not None:
+            raise ValueError(reason)
         self.board[point] = color
-        single_captures = []
-        neighbors = self.neighbors[point]
-        for nb in neighbors:
-            if self.board[nb] == opp_color:
-                single_capture = self._detect_and_process_capture(nb)
-                if single_capture == True:
-                    raise ValueError("capture")
-        if not self._stone_has_liberty(point):
-            # check suicide of whole block
-            block = self._block_of(point)
-            if not self._has_liberty(block):  # undo suicide move
-                self.board[point] = EMPTY
-                raise ValueError("suicide")
-        self.ko_recapture = None
-        if in_enemy_eye and len(single_captures) == 1:
-            self.ko_recapture = single_captures[0]
+        if color == BLACK:
+            self.bb_black |= 1 << point
+        else:
+            self.bb_white |= 1 << point
+        to_play = ZOBRIST_TO_PLAY if self.current_player == color else 0
+        self._hashes = [h ^ key ^ to_play for h, key in
+                        zip(self._hashes, self.zobTable[color][point])]
         self.current_player = GoBoardUtil.opponent(color)
         return True
 
     def undoMove(self, move):
+        move = int(move)
         self.current_player = GoBoardUtil.opponent(self.current_player)
+        self._hashes = [h ^ key ^ ZOBRIST_TO_PLAY for h, key in
+                        zip(self._hashes, self.zobTable[self.board[move]][move])]
         self.board[move] = EMPTY
+        self.bb_black &= ~(1 << move)
+        self.bb_white &= ~(1 << move)
 
-    def get_all_codes(self):
-        mask = [False] * self.NS + ([False] + [True] * self.size) * self.size + [False] * self.NS + [False]
-        new_board = self.board[mask]
-        new_board = new_board.reshape((self.size, self.size))
-        transpose = new_board.transpose()
-        horizontal_mirror = np.flipud(new_board)
-        vertical_mirror = np.fliplr(new_board)
-        transpose_horizontal_mirror = np.flipud(transpose)
-        transpose_vertical_mirror = np.fliplr(transpose)
-        center_mirror = np.fliplr(horizontal_mirror)
-        all_isomorphism = [new_board, transpose, center_mirror, horizontal_mirror, vertical_mirror,
-                           transpose_horizontal_mirror, transpose_vertical_mirror]
-        return set(map(lambda x: self.code_from_pure_board(x), all_isomorphism))
     def if_any_stone_nearby(self,point,color):
         # return any(map(lambda x: self.board[x] == color,self._diag_neighbors(point))) or any(map(lambda x: self.board[x] == GoBoardUtil.opponent(color)),self._diag_neighbors(point))
-        return any(map(lambda x: self.board[x] == color,self._diag_neighbors(point))) or any(map(lambda x: self.board[x] == color,self._neighbors(point)))
-    def code_from_pure_board(self, pure_board):
-        c = 0
-        count = 0
-        for col in pure_board:
-            for i in col:
-                c = c ^ self.zobTable[count][i]
-                count += 1
-        return c
-
+        return bool(self.nearby_mask[point] & self._stones(color))
     def code(self):
-        c = 0
-        count = 0
-        for i in self.board:
-            if i != BORDER:
-                c = c ^ self.zobTable[count][i]
-                count += 1
-        return c
+        """
+        Zobrist hash of the position, including the side to move.
+        The smallest hash over the 8 symmetric positions is used,
+        so symmetric positions share one code.
+        Maintained incrementally by play_move and undoMove.
+        """
+        return min(self._hashes)
+
+    def canonical_code(self):
+        """
+        Return code() and the symmetry s that produces it.
+        sym_to[s] maps points of this board to the position hashed by code(),
+        sym_from[s] maps them back.
+        """
+        code = min(self._hashes)
+        return code, self._hashes.index(code)
 
     def can_be_played(self, point):
 
@@ -324,27 +431,11 @@ class SimpleGoBoard(object):
     def is_corner (self,point):
         return sum(map(lambda x: self.board[x] == BORDER, [point - self.NS, point + self.NS, point - 1, point + 1])) == 2
     def get_legal_move_count_for_two_color(self, color):
-        empty = self.get_empty_points()
-        for_color = 0
-        for_opponent = 0
-        for pt in empty:
-            if self.is_legal(pt,color):
-                for_color +=1
-            if self.is_legal(pt,GoBoardUtil.opponent(color)):
-                for_opponent +=1
+        for_color = self._legal_bits(color).bit_count()
+        for_opponent = self._legal_bits(GoBoardUtil.opponent(color)).bit_count()
         return for_color,for_opponent
-    def get_symmetry(self):
-        not_match=None
-        for point in range(self.maxpoint):
-            if self.board[point] == BLACK:
-                return self.NS**2+self.NS-point
-        return None
     def count_steps(self):
-        count = 0
-        for i in self.board:
-            if i == WHITE or i==BLACK:
-                count+=1
-        return count
+        return (self.bb_black | self.bb_white).bit_count()
     def neighbors_of_color(self, point, color):
         """ List of neighbors of point of given color """
         nbc = []